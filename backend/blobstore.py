@@ -0,0 +1,121 @@
+"""
+Content-addressed blob store for CSV files and charts.
+
+Blobs are stored once under BLOBS_DIR keyed by their SHA-256 digest and are
+reference counted by the CSVFile and Chart rows that point at them, so
+identical uploads or chart outputs share the same bytes on disk. A blob whose
+count drops to zero is handed to the file reaper for removal.
+"""
+import hashlib
+import os
+import shutil
+import uuid
+
+from sqlalchemy import update
+from sqlalchemy.dialects.sqlite import insert
+
+from models import Blob
+from reaper import enqueue_deletion
+
+BLOBS_DIR = os.getenv("BLOBS_DIR", "/app/data/blobs")
+BLOBS_TMP_DIR = os.path.join(BLOBS_DIR, "tmp")
+
+CHUNK_SIZE = 1024 * 1024
+
+os.makedirs(BLOBS_TMP_DIR, exist_ok=True)
+
+
+def blob_path(blob_hash):
+    """Location of a blob on disk, fanned out by the first two hex digits"""
+    return os.path.join(BLOBS_DIR, blob_hash[:2], blob_hash)
+
+
+def _acquire(db, src_path, blob_hash, size):
+    """Take a reference on blob_hash and move src_path into place if needed"""
+    # The upsert takes the SQLite write lock, so the reaper cannot remove this
+    # blob between here and the caller's commit
+    db.execute(
+        insert(Blob)
+        .values(hash=blob_hash, size=size, ref_count=1)
+        .on_conflict_do_update(
+            index_elements=[Blob.hash],
+            set_={"ref_count": Blob.ref_count + 1},
+        )
+    )
+    path = blob_path(blob_hash)
+    if os.path.exists(path):
+        os.remove(src_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.move(src_path, path)
+    return db.get(Blob, blob_hash, populate_existing=True)
+
+
+def store_stream(db, fileobj):
+    """Store the contents of a file object, returning its referenced Blob"""
+    tmp_path = os.path.join(BLOBS_TMP_DIR, str(uuid.uuid4()))
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as buffer:
+            while True:
+                chunk = fileobj.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                buffer.write(chunk)
+                size += len(chunk)
+        return _acquire(db, tmp_path, digest.hexdigest(), size)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def file_hash(path):
+    """SHA-256 of a file, as used for blob names"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store_file(db, path, blob_hash=None):
+    """
+    Move an existing file into the store, returning its referenced Blob.
+
+    Pass blob_hash if the file was already hashed, so the caller can do that
+    before opening a write transaction.
+    """
+    return _acquire(db, path, blob_hash or file_hash(path), os.path.getsize(path))
+
+
+def retain_blob(db, blob_hash):
+    """Take another reference on a blob that is already stored"""
+    db.execute(
+        update(Blob)
+        .where(Blob.hash == blob_hash)
+        .values(ref_count=Blob.ref_count + 1)
+    )
+
+
+def release_blob(db, blob_hash):
+    """Drop one reference to a blob, queueing its file once unreferenced"""
+    db.execute(
+        update(Blob)
+        .where(Blob.hash == blob_hash)
+        .values(ref_count=Blob.ref_count - 1)
+    )
+    blob = db.get(Blob, blob_hash, populate_existing=True)
+    if blob is not None and blob.ref_count <= 0:
+        enqueue_deletion(db, blob_path(blob_hash))
+        db.delete(blob)
+
+
+def release_file(db, row):
+    """Release the file behind a CSVFile or Chart row that is being deleted"""
+    if row.blob_hash:
+        release_blob(db, row.blob_hash)
+    else:
+        # Files stored before the blob store existed live in the flight folder
+        enqueue_deletion(db, row.file_path)
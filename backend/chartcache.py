@@ -0,0 +1,102 @@
+"""
+Result cache for chart scripts.
+
+Chart scripts are pure functions of their source and input data, so their
+outputs are cached under a key built from the script hash, the input data
+hash and any parameters. Cached outputs are blobs in the blob store that the
+cache holds a reference on, which lets flights with identical data share both
+the rendering work and the chart bytes. Entries are evicted least recently
+used first once the cache holds more than CHART_CACHE_MAX_BYTES.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy.dialects.sqlite import insert
+
+from blobstore import blob_path, file_hash, retain_blob, release_blob
+from models import ChartCacheEntry
+
+CHART_CACHE_MAX_BYTES = int(os.getenv("CHART_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+def input_fingerprint(csv_files):
+    """Hash of a flight's CSV data, in the order the scripts receive it"""
+    digest = hashlib.sha256()
+    for csv_file in csv_files:
+        # Files stored before the blob store existed have to be hashed
+        digest.update((csv_file.blob_hash or file_hash(csv_file.file_path)).encode())
+    return digest.hexdigest()
+
+
+def chart_cache_key(script_path, input_hash, params=None):
+    """Cache key for running a script on the given input"""
+    key = {
+        "script": file_hash(script_path),
+        "input": input_hash,
+        "params": params or {},
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def _drop_entry(db, entry):
+    for _, blob_hash in json.loads(entry.outputs):
+        release_blob(db, blob_hash)
+    db.delete(entry)
+
+
+def peek_chart_cache(db, key):
+    """Like lookup_chart_cache, but read-only so it can run outside a write transaction"""
+    entry = db.get(ChartCacheEntry, key)
+    if entry is None:
+        return None
+    outputs = json.loads(entry.outputs)
+    if not all(os.path.exists(blob_path(blob_hash)) for _, blob_hash in outputs):
+        return None
+    return outputs
+
+
+def lookup_chart_cache(db, key):
+    """Return cached (chart_file, blob_hash) outputs for key, or None"""
+    entry = db.get(ChartCacheEntry, key)
+    if entry is None:
+        return None
+
+    outputs = json.loads(entry.outputs)
+    if not all(os.path.exists(blob_path(blob_hash)) for _, blob_hash in outputs):
+        # Stored files went missing; forget the entry so the script runs again
+        _drop_entry(db, entry)
+        return None
+
+    entry.last_used_at = datetime.utcnow()
+    return outputs
+
+
+def store_chart_cache(db, key, outputs):
+    """Cache a script's (chart_file, blob_hash) outputs and enforce the size budget"""
+    # Drops an existing entry whose files went missing, so it can be replaced
+    lookup_chart_cache(db, key)
+
+    sizes = [os.path.getsize(blob_path(blob_hash)) for _, blob_hash in outputs]
+    result = db.execute(
+        insert(ChartCacheEntry)
+        .values(key=key, outputs=json.dumps(outputs), size=sum(sizes), last_used_at=datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=[ChartCacheEntry.key])
+    )
+    # Another request may have cached the same result first
+    if result.rowcount:
+        for _, blob_hash in outputs:
+            retain_blob(db, blob_hash)
+    evict_chart_cache(db)
+
+
+def evict_chart_cache(db, max_bytes=CHART_CACHE_MAX_BYTES):
+    """Drop least recently used entries until the cache fits in max_bytes"""
+    entries = db.query(ChartCacheEntry).order_by(ChartCacheEntry.last_used_at).all()
+    total = sum(entry.size for entry in entries)
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        total -= entry.size
+        _drop_entry(db, entry)
@@ -1,28 +1,76 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from models import Base
+from contextlib import contextmanager
+import fcntl
 import os
 from pathlib import Path
 
 # SQLite database file path
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./flight_manager.db")
 
+# How long a writer waits for the SQLite write lock before failing (seconds)
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))
+
 # Extract file path from SQLite URL and ensure directory exists
+db_path = None
 if DATABASE_URL.startswith("sqlite:///"):
     db_path = DATABASE_URL.replace("sqlite:///", "")
     db_dir = Path(db_path).parent
     if db_dir and str(db_dir) != ".":
         db_dir.mkdir(parents=True, exist_ok=True)
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT},
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+@event.listens_for(engine, "connect")
+def _configure_sqlite(dbapi_connection, connection_record):
+    """Tune SQLite for concurrent readers and a single writer across workers"""
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers proceed while a write is in progress
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # Safe with WAL and avoids an fsync on every commit
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+@contextmanager
+def _migration_lock():
+    """Serialize init_db across worker processes sharing the database file"""
+    if db_path is None:
+        yield
+        return
+    with open(db_path + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
 def init_db():
-    """Initialize the database tables"""
+    """Initialize the database tables, one worker process at a time"""
+    with _migration_lock():
+        _migrate()
+        _clear_job_claims()
+
+
+def _clear_job_claims():
+    # Runs before the workers start, so any claim belongs to a process that
+    # is gone and would otherwise block its job until the lease expires
+    from sqlalchemy import text
+    with engine.begin() as conn:
+        conn.execute(text('DELETE FROM job_claims'))
+
+
+def _migrate():
     Base.metadata.create_all(bind=engine)
     
-    # Add new columns to existing flights table if they don't exist
+    # Add new columns to existing tables if they don't exist
     # This handles schema migrations for SQLite
     try:
         from sqlalchemy import inspect, text
@@ -42,9 +90,28 @@ def init_db():
                 if 'description' not in columns:
                     conn.execute(text('ALTER TABLE flights ADD COLUMN description TEXT'))
                     conn.commit()
+        
+        # Add blob_hash column to csv_files and charts if it doesn't exist
+        for table in ('csv_files', 'charts'):
+            if table in inspector.get_table_names():
+                columns = [col['name'] for col in inspector.get_columns(table)]
+                
+                if 'blob_hash' not in columns:
+                    with engine.connect() as conn:
+                        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN blob_hash VARCHAR'))
+                        conn.commit()
+        
+        # Add detail column to job_claims if it doesn't exist
+        if 'job_claims' in inspector.get_table_names():
+            columns = [col['name'] for col in inspector.get_columns('job_claims')]
+            
+            if 'detail' not in columns:
+                with engine.connect() as conn:
+                    conn.execute(text('ALTER TABLE job_claims ADD COLUMN detail TEXT'))
+                    conn.commit()
     except Exception as e:
         # Migration failed, but this is not critical - log and continue
-        print(f"Warning: Could not migrate flights table: {e}")
+        print(f"Warning: Could not migrate database tables: {e}")
 
 
 def get_db():
@@ -0,0 +1,118 @@
+"""
+Cross-worker job claims.
+
+When the API runs with several worker processes, work such as rendering a
+flight's charts must only run in one of them. A worker claims a job by
+inserting a row keyed by the job name; other workers see the claim and wait
+for it instead of repeating the work. A claim is a short lease that its
+owner renews while the job runs (see job_heartbeat); one that was not renewed
+within JOB_CLAIM_TIMEOUT is treated as abandoned (e.g. the worker crashed)
+and can be taken over. Claims left by previous processes are cleared by
+init_db before the workers start.
+"""
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy.dialects.sqlite import insert
+
+from database import SessionLocal
+from models import JobClaim
+
+JOB_CLAIM_TIMEOUT = float(os.getenv("JOB_CLAIM_TIMEOUT", "30"))
+JOB_POLL_INTERVAL = 0.5
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_job(key, timeout=JOB_CLAIM_TIMEOUT, detail=None):
+    """
+    Try to claim a job, returning True if this worker now owns it.
+
+    detail is stored with the claim for other workers, e.g. where the job
+    writes its output.
+    """
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            insert(JobClaim)
+            .values(key=key, owner=WORKER_ID, claimed_at=now, detail=detail)
+            .on_conflict_do_update(
+                index_elements=[JobClaim.key],
+                set_={"owner": WORKER_ID, "claimed_at": now, "detail": detail},
+                where=JobClaim.claimed_at < now - timedelta(seconds=timeout),
+            )
+        )
+        db.commit()
+        return result.rowcount == 1
+    finally:
+        db.close()
+
+
+def renew_job(key):
+    """Refresh a claim held by this worker so it does not time out, returning False if it was lost"""
+    db = SessionLocal()
+    try:
+        renewed = (
+            db.query(JobClaim)
+            .filter(JobClaim.key == key, JobClaim.owner == WORKER_ID)
+            .update({"claimed_at": datetime.utcnow()})
+        )
+        db.commit()
+        return renewed == 1
+    finally:
+        db.close()
+
+
+def live_claim(key, timeout=JOB_CLAIM_TIMEOUT):
+    """Return the live claim on a job (with owner and detail), or None"""
+    db = SessionLocal()
+    try:
+        claim = db.get(JobClaim, key)
+        if claim is None or claim.claimed_at < datetime.utcnow() - timedelta(seconds=timeout):
+            return None
+        return claim
+    finally:
+        db.close()
+
+
+def release_job(key):
+    """Release a job claimed by this worker"""
+    db = SessionLocal()
+    try:
+        db.query(JobClaim).filter(JobClaim.key == key, JobClaim.owner == WORKER_ID).delete()
+        db.commit()
+    finally:
+        db.close()
+
+
+@contextmanager
+def job_heartbeat(key, interval=JOB_CLAIM_TIMEOUT / 3):
+    """Renew a claimed job from a background thread while the block runs, then release it"""
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(interval):
+            try:
+                renew_job(key)
+            except Exception as e:
+                print(f"Warning: Could not renew job {key}: {e}")
+
+    thread = threading.Thread(target=renew, name=f"job-heartbeat:{key}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+        release_job(key)
+
+
+def wait_for_job(key, timeout=JOB_CLAIM_TIMEOUT):
+    """Block until another worker's claim on a job is released or abandoned"""
+    while live_claim(key, timeout) is not None:
+        time.sleep(JOB_POLL_INTERVAL)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Load test for the multi-worker deployment mode.
+
+Starts the API with an increasing number of uvicorn workers against a fresh
+database and runs three kinds of client processes at the same time:
+
+- readers list the flights of a seeded payload
+- writers create payloads
+- renderers create a flight, upload a CSV file and generate its charts with
+  a chart script that takes --render-seconds, so writes overlap renders
+
+Prints throughput and failed requests for each worker count so scaling with
+cores can be compared and lock contention between renders and writes shows
+up as errors.
+
+    cd backend
+    python loadtest.py --workers 1 2 4 --duration 10
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+HOST = "127.0.0.1"
+
+RENDER_SCRIPT = """
+import os
+import time
+
+time.sleep(float(os.environ['LOADTEST_RENDER_SECONDS']))
+with open(os.path.join(os.environ['FLIGHT_CHARTS_DIR'], 'loadtest.html'), 'w') as f:
+    f.write('<html></html>')
+print('loadtest.html')
+"""
+
+
+def _request(conn, method, path, body=None, headers=None):
+    if body is not None and headers is None:
+        headers = {"Content-Type": "application/json"}
+        body = json.dumps(body)
+    conn.request(method, path, body=body, headers=headers or {})
+    response = conn.getresponse()
+    data = response.read()
+    if response.status != 200:
+        raise RuntimeError(f"{method} {path} returned {response.status}: {data[:200]}")
+    return json.loads(data)
+
+
+def _upload(conn, path, filename, data):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        "Content-Type: text/csv\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+    return _request(conn, "POST", path, body, headers)
+
+
+def _wait_until_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection(HOST, port, timeout=1)
+            _request(conn, "GET", "/api/payloads")
+            conn.close()
+            return
+        except (OSError, RuntimeError):
+            time.sleep(0.2)
+    raise RuntimeError("API did not start")
+
+
+def _seed(port, flights):
+    conn = http.client.HTTPConnection(HOST, port)
+    payload = _request(conn, "POST", "/api/payloads", {"name": "Load test payload"})
+    for i in range(flights):
+        _request(conn, "POST", "/api/flights", {
+            "payload_id": payload["id"],
+            "flight_date": "2024-01-01T12:00:00",
+            "name": f"Flight {i}",
+        })
+    conn.close()
+    return payload["id"]
+
+
+def _read(conn, payload_id, i):
+    _request(conn, "GET", f"/api/flights?payload_id={payload_id}")
+
+
+def _write(conn, payload_id, i):
+    _request(conn, "POST", "/api/payloads", {"name": f"Load test write {i}"})
+
+
+def _render(conn, payload_id, i):
+    flight = _request(conn, "POST", "/api/flights", {
+        "payload_id": payload_id,
+        "flight_date": "2024-01-01T12:00:00",
+    })
+    # Unique data per flight so the chart cache does not short-circuit the render
+    data = f"time,altitude\n0,0\n1,{uuid.uuid4().int % 1000}\n".encode()
+    _upload(conn, f"/api/flights/{flight['id']}/csv", "flight.csv", data)
+    _request(conn, "POST", f"/api/flights/{flight['id']}/charts/generate")
+
+
+def _client(kind, port, payload_id, duration, results):
+    action = {"read": _read, "write": _write, "render": _render}[kind]
+    conn = http.client.HTTPConnection(HOST, port, timeout=120)
+    ok = errors = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        try:
+            action(conn, payload_id, ok + errors)
+            ok += 1
+        except (OSError, RuntimeError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(HOST, port, timeout=120)
+    conn.close()
+    results.put((kind, ok, errors))
+
+
+def run(workers, clients, duration, flights, port):
+    """Run all clients against the given number of workers, returning {kind: (ok, errors)}"""
+    with tempfile.TemporaryDirectory() as data_dir:
+        scripts_dir = os.path.join(data_dir, "chart_scripts")
+        os.makedirs(scripts_dir)
+        with open(os.path.join(scripts_dir, "loadtest_chart.py"), "w") as f:
+            f.write(RENDER_SCRIPT)
+
+        env = os.environ.copy()
+        env.update({
+            "DATABASE_URL": f"sqlite:///{data_dir}/flight_manager.db",
+            "FLIGHTS_DIR": os.path.join(data_dir, "flights"),
+            "BLOBS_DIR": os.path.join(data_dir, "blobs"),
+            "CHARTS_DIR": os.path.join(data_dir, "charts"),
+            "CHART_SCRIPTS_DIR": scripts_dir,
+        })
+        backend_dir = os.path.dirname(os.path.abspath(__file__))
+
+        # Start the same way start.sh does: migrate once, then the workers
+        subprocess.run(
+            [sys.executable, "-c", "from database import init_db; init_db()"],
+            env=env, cwd=backend_dir, check=True,
+        )
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", HOST, "--port", str(port),
+             "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+            env=dict(env, SKIP_INIT_DB="1"),
+            cwd=backend_dir,
+        )
+        try:
+            _wait_until_ready(port)
+            payload_id = _seed(port, flights)
+
+            results = multiprocessing.Queue()
+            procs = [
+                multiprocessing.Process(target=_client, args=(kind, port, payload_id, duration, results))
+                for kind, count in clients.items()
+                for _ in range(count)
+            ]
+            for proc in procs:
+                proc.start()
+            totals = {kind: (0, 0) for kind in clients}
+            for _ in procs:
+                kind, ok, errors = results.get()
+                totals[kind] = (totals[kind][0] + ok, totals[kind][1] + errors)
+            for proc in procs:
+                proc.join()
+            return totals
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    default_workers = sorted({1, *(n for n in (2, 4, 8) if n <= cpus), cpus})
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=default_workers)
+    parser.add_argument("--readers", type=int, default=2 * cpus)
+    parser.add_argument("--writers", type=int, default=1)
+    parser.add_argument("--renderers", type=int, default=1)
+    parser.add_argument("--render-seconds", type=float, default=2)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--flights", type=int, default=50)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    os.environ["LOADTEST_RENDER_SECONDS"] = str(args.render_seconds)
+    clients = {"read": args.readers, "write": args.writers, "render": args.renderers}
+
+    print(f"{cpus} CPUs, {args.readers} readers, {args.writers} writers, "
+          f"{args.renderers} renderers ({args.render_seconds:g}s renders), {args.duration:g}s per run")
+    print(f"{'workers':>8} {'read/s':>10} {'speedup':>8} {'write/s':>8} {'renders':>8} {'errors':>7}")
+    baseline = None
+    for workers in args.workers:
+        totals = run(workers, clients, args.duration, args.flights, args.port)
+        read_rate = totals["read"][0] / args.duration
+        baseline = baseline or read_rate
+        errors = sum(failed for _, failed in totals.values())
+        print(f"{workers:>8} {read_rate:>10.1f} {read_rate / baseline:>7.2f}x "
+              f"{totals['write'][0] / args.duration:>8.1f} {totals['render'][0]:>8} {errors:>7}")
+
+
+if __name__ == "__main__":
+    main()
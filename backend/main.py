@@ -1,15 +1,24 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from typing import List
 import os
-import shutil
+import asyncio
+import mimetypes
 import subprocess
+import time
 import uuid
 from datetime import datetime
 
-from database import get_db, init_db
+from database import SessionLocal, get_db, init_db
 from models import Payload, Flight, CSVFile, Chart
+from reaper import FileReaper, enqueue_deletion
+from blobstore import BLOBS_DIR, blob_path, file_hash, store_stream, store_file, retain_blob, release_blob, release_file
+from jobs import JOB_CLAIM_TIMEOUT, WORKER_ID, claim_job, renew_job, job_heartbeat, live_claim, release_job, wait_for_job
+from chartcache import input_fingerprint, chart_cache_key, peek_chart_cache, lookup_chart_cache, store_chart_cache
+from telemetry import TelemetryHub, TelemetryTail, TELEMETRY_FLUSH_INTERVAL, TELEMETRY_OWNER_CHECK_INTERVAL
+import processing
 from schemas import (
     Payload as PayloadSchema,
     PayloadCreate,
@@ -21,8 +30,10 @@ from schemas import (
     Chart as ChartSchema,
 )
 
-# Initialize database on startup
-init_db()
+# Initialize database on startup. start.sh migrates once before starting the
+# workers and sets SKIP_INIT_DB so each worker does not repeat it on import.
+if os.getenv("SKIP_INIT_DB", "") != "1":
+    init_db()
 
 app = FastAPI(title="Flight Manager Lite API")
 
@@ -44,6 +55,23 @@ os.makedirs(FLIGHTS_DIR, exist_ok=True)
 os.makedirs(CHART_SCRIPTS_DIR, exist_ok=True)
 os.makedirs(CHARTS_DIR, exist_ok=True)
 
+# Background file cleanup - deletes only commit metadata and queue the files
+reaper = FileReaper(FLIGHTS_DIR, BLOBS_DIR)
+
+
+# Live telemetry streams and their viewers
+telemetry_hub = TelemetryHub()
+
+
+@app.on_event("startup")
+def start_reaper():
+    reaper.start()
+
+
+@app.on_event("shutdown")
+def stop_reaper():
+    reaper.stop()
+
 
 # Payload endpoints
 @app.get("/api/payloads", response_model=List[PayloadSchema])
@@ -90,8 +118,15 @@ def delete_payload(payload_id: str, db: Session = Depends(get_db)):
     if not db_payload:
         raise HTTPException(status_code=404, detail="Payload not found")
     
+    # Release stored files and queue the payload directory for removal
+    for db_flight in db_payload.flights:
+        for row in db_flight.csv_files + db_flight.charts:
+            release_file(db, row)
+    enqueue_deletion(db, os.path.join(FLIGHTS_DIR, db_payload.id))
+    
     db.delete(db_payload)
     db.commit()
+    reaper.wake()
     return {"message": "Payload deleted successfully"}
 
 
@@ -157,14 +192,16 @@ def delete_flight(flight_id: str, db: Session = Depends(get_db)):
     if not db_flight:
         raise HTTPException(status_code=404, detail="Flight not found")
     
-    # Delete flight directory and all its contents
+    # Release stored files and queue the flight directory for removal
+    for row in db_flight.csv_files + db_flight.charts:
+        release_file(db, row)
     payload_dir = os.path.join(FLIGHTS_DIR, db_flight.payload_id)
     flight_dir = os.path.join(payload_dir, db_flight.id)
-    if os.path.exists(flight_dir):
-        shutil.rmtree(flight_dir)
+    enqueue_deletion(db, flight_dir)
     
     db.delete(db_flight)
     db.commit()
+    reaper.wake()
     return {"message": "Flight deleted successfully"}
 
 
@@ -175,21 +212,15 @@ def upload_csv(flight_id: str, file: UploadFile = File(...), db: Session = Depen
     if not db_flight:
         raise HTTPException(status_code=404, detail="Flight not found")
     
-    # Create flight directory if it doesn't exist
-    payload_dir = os.path.join(FLIGHTS_DIR, db_flight.payload_id)
-    flight_dir = os.path.join(payload_dir, db_flight.id)
-    os.makedirs(flight_dir, exist_ok=True)
-    
-    # Save uploaded file
-    file_path = os.path.join(flight_dir, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Save uploaded file to the blob store, sharing bytes with identical uploads
+    blob = store_stream(db, file.file)
     
     # Create CSVFile record
     db_csv_file = CSVFile(
         flight_id=flight_id,
         filename=file.filename,
-        file_path=file_path
+        file_path=blob_path(blob.hash),
+        blob_hash=blob.hash
     )
     db.add(db_csv_file)
     db.commit()
@@ -210,15 +241,204 @@ def delete_csv_file(csv_id: str, db: Session = Depends(get_db)):
     if not db_csv_file:
         raise HTTPException(status_code=404, detail="CSV file not found")
     
-    # Delete file from disk
-    if os.path.exists(db_csv_file.file_path):
-        os.remove(db_csv_file.file_path)
+    # Release the stored file
+    release_file(db, db_csv_file)
     
     db.delete(db_csv_file)
     db.commit()
+    reaper.wake()
     return {"message": "CSV file deleted successfully"}
 
 
+# Live telemetry endpoints
+def _finish_telemetry(flight_id, stream):
+    """Store a closed telemetry stream as a CSV file of its flight"""
+    db = SessionLocal()
+    try:
+        db_csv_file = None
+        db_flight = db.query(Flight).filter(Flight.id == flight_id).first()
+        if db_flight and stream.rows and not os.path.exists(stream.spool_path):
+            print(f"Warning: Telemetry spool for flight {flight_id} is gone, {stream.rows} rows were lost")
+        elif db_flight and stream.rows:
+            blob = store_file(db, stream.spool_path)
+            db_csv_file = CSVFile(
+                flight_id=flight_id,
+                filename=f"telemetry_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.csv",
+                file_path=blob_path(blob.hash),
+                blob_hash=blob.hash
+            )
+            db.add(db_csv_file)
+        
+        # Column buffers are only needed while the stream is live
+        enqueue_deletion(db, stream.stream_dir)
+        db.commit()
+        reaper.wake()
+        return db_csv_file.id if db_csv_file else None
+    finally:
+        db.close()
+
+
+@app.websocket("/api/flights/{flight_id}/telemetry")
+async def ingest_telemetry(websocket: WebSocket, flight_id: str, db: Session = Depends(get_db)):
+    db_flight = db.query(Flight).filter(Flight.id == flight_id).first()
+    if not db_flight:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    stream_dir = os.path.join(FLIGHTS_DIR, db_flight.payload_id, db_flight.id, f"telemetry-{uuid.uuid4()}")
+    db.close()
+    
+    # Only one receiver may stream into a flight at a time, across all workers.
+    # The claim tells other workers where to find the stream for their viewers
+    job_key = f"telemetry:{flight_id}"
+    if not await run_in_threadpool(claim_job, job_key, detail=stream_dir):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    stream = telemetry_hub.open_stream(flight_id, stream_dir)
+    if stream is None:
+        await run_in_threadpool(release_job, job_key)
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    async def flush():
+        message = await run_in_threadpool(stream.flush)
+        if message is not None:
+            telemetry_hub.publish(flight_id, message)
+    
+    await websocket.accept()
+    last_renewed = time.monotonic()
+    try:
+        # Each text message carries one or more CSV lines, the first being the header
+        while not stream.lost:
+            # Keep the claim alive for as long as the stream runs
+            if time.monotonic() - last_renewed >= JOB_CLAIM_TIMEOUT / 3:
+                await run_in_threadpool(renew_job, job_key)
+                last_renewed = time.monotonic()
+            try:
+                text = await asyncio.wait_for(websocket.receive_text(), timeout=TELEMETRY_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                await flush()
+                continue
+            if stream.append(text):
+                await flush()
+        # The stream folder was removed, e.g. the flight was deleted mid-stream
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Telemetry stream was removed")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        try:
+            await flush()
+        finally:
+            telemetry_hub.close_stream(flight_id)
+            # Store what was spooled even if the last flush failed
+            try:
+                csv_file_id = await run_in_threadpool(_finish_telemetry, flight_id, stream)
+                telemetry_hub.publish(flight_id, {"event": "closed", "csv_file_id": csv_file_id})
+            finally:
+                await run_in_threadpool(release_job, job_key)
+
+
+def _latest_telemetry_csv(flight_id, since):
+    """Id of the CSV file stored for a telemetry stream that ended after since"""
+    db = SessionLocal()
+    try:
+        db_csv_file = (
+            db.query(CSVFile)
+            .filter(
+                CSVFile.flight_id == flight_id,
+                CSVFile.filename.like("telemetry_%"),
+                CSVFile.uploaded_at >= since,
+            )
+            .order_by(CSVFile.uploaded_at.desc())
+            .first()
+        )
+        return db_csv_file.id if db_csv_file else None
+    finally:
+        db.close()
+
+
+async def _end_tail(flight_id, tail, started):
+    message = await run_in_threadpool(tail.poll)
+    if message is not None:
+        telemetry_hub.publish(flight_id, message)
+    csv_file_id = await run_in_threadpool(_latest_telemetry_csv, flight_id, started)
+    telemetry_hub.publish(flight_id, {"event": "closed", "csv_file_id": csv_file_id})
+
+
+async def _follow_telemetry(flight_id):
+    """
+    Relay a stream ingested by another worker to this worker's viewers.
+    
+    Runs while the flight has viewers here. The ingesting worker stores the
+    stream folder in its claim, and the stream's files are tailed from there.
+    """
+    job_key = f"telemetry:{flight_id}"
+    tail = None
+    started = None
+    next_check = 0.0
+    try:
+        while flight_id in telemetry_hub.viewers:
+            try:
+                if time.monotonic() >= next_check:
+                    next_check = time.monotonic() + TELEMETRY_OWNER_CHECK_INTERVAL
+                    claim = await run_in_threadpool(live_claim, job_key)
+                    remote_dir = claim.detail if claim is not None and claim.owner != WORKER_ID else None
+                    if tail is not None and tail.stream_dir != remote_dir:
+                        telemetry_hub.tails.pop(flight_id, None)
+                        await _end_tail(flight_id, tail, started)
+                        tail = None
+                    if tail is None and remote_dir:
+                        tail = TelemetryTail(flight_id, remote_dir)
+                        started = datetime.utcnow()
+                        telemetry_hub.publish(flight_id, await run_in_threadpool(tail.snapshot))
+                        telemetry_hub.tails[flight_id] = tail
+                if tail is not None:
+                    message = await run_in_threadpool(tail.poll)
+                    if message is not None:
+                        telemetry_hub.publish(flight_id, message)
+            except Exception as e:
+                print(f"Error following telemetry for flight {flight_id}: {e}")
+            await asyncio.sleep(TELEMETRY_FLUSH_INTERVAL)
+    finally:
+        telemetry_hub.tails.pop(flight_id, None)
+        telemetry_hub.followers.pop(flight_id, None)
+
+
+@app.websocket("/api/flights/{flight_id}/telemetry/live")
+async def watch_telemetry(websocket: WebSocket, flight_id: str):
+    await websocket.accept()
+    queue = telemetry_hub.subscribe(flight_id)
+    # Streams ingested by another worker reach this worker's viewers through
+    # one follower task per flight
+    if flight_id not in telemetry_hub.followers:
+        telemetry_hub.followers[flight_id] = asyncio.ensure_future(_follow_telemetry(flight_id))
+    # Viewers only listen, but receiving is how a disconnect is noticed
+    receiver = asyncio.ensure_future(websocket.receive())
+    try:
+        source = telemetry_hub.streams.get(flight_id) or telemetry_hub.tails.get(flight_id)
+        if source is not None:
+            snapshot = await run_in_threadpool(source.snapshot)
+            if snapshot["columns"]:
+                await websocket.send_json(snapshot)
+        
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                await websocket.send_json(getter.result())
+            else:
+                getter.cancel()
+            if receiver in done:
+                if receiver.result()["type"] == "websocket.disconnect":
+                    break
+                receiver = asyncio.ensure_future(websocket.receive())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        telemetry_hub.unsubscribe(flight_id, queue)
+
+
 # Chart generation endpoint
 @app.post("/api/flights/{flight_id}/charts/generate", response_model=List[ChartSchema])
 def generate_charts(flight_id: str, db: Session = Depends(get_db)):
@@ -231,6 +451,55 @@ def generate_charts(flight_id: str, db: Session = Depends(get_db)):
     if not csv_files:
         raise HTTPException(status_code=400, detail="No CSV files found for this flight")
     
+    # Only one worker renders a flight's charts at a time. The others wait for
+    # it and then claim the job themselves, which returns its charts if they
+    # are up to date and renders them otherwise (e.g. its worker died)
+    job_key = f"charts:{flight_id}"
+    while not claim_job(job_key):
+        wait_for_job(job_key)
+        db.expire_all()
+    
+    with job_heartbeat(job_key):
+        return _render_charts(db, db_flight, csv_files)
+
+
+def _render_signals(db, csv_files, input_hash, work_dir):
+    """
+    Run the signal processing stage unless its result is already cached.
+    
+    Only reads the database. Returns (cache_key, cached, signals_hash,
+    signals_path); a fresh result stays in work_dir until _store_signals.
+    """
+    cache_key = chart_cache_key(processing.__file__, input_hash, processing.processing_params())
+    cached_outputs = peek_chart_cache(db, cache_key)
+    if cached_outputs is not None:
+        if not cached_outputs:
+            return cache_key, True, None, None
+        signals_hash = cached_outputs[0][1]
+        return cache_key, True, signals_hash, blob_path(signals_hash)
+    
+    signals_path = os.path.join(work_dir, "signals.npz")
+    if processing.process_flight([cf.file_path for cf in csv_files], signals_path):
+        return cache_key, False, file_hash(signals_path), signals_path
+    return cache_key, False, None, None
+
+
+def _store_signals(db, cache_key, signals_hash, signals_path):
+    """Store a fresh signal processing result in the blob store and cache"""
+    outputs = []
+    if signals_hash:
+        store_file(db, signals_path, signals_hash)
+        outputs.append(("signals.npz", signals_hash))
+    store_chart_cache(db, cache_key, outputs)
+    # The cache entry now holds the reference taken by store_file
+    for _, blob_hash in outputs:
+        release_blob(db, blob_hash)
+
+
+def _render_charts(db, db_flight, csv_files):
+    """Regenerate a flight's charts if its CSV data changed since they were made"""
+    flight_id = db_flight.id
+    
     # Get existing charts for this flight
     existing_charts = db.query(Chart).filter(Chart.flight_id == flight_id).all()
     
@@ -259,11 +528,11 @@ def generate_charts(flight_id: str, db: Session = Depends(get_db)):
     # Delete existing charts if we need to regenerate
     if needs_regeneration and existing_charts:
         for chart in existing_charts:
-            # Delete file from disk
-            if os.path.exists(chart.file_path):
-                os.remove(chart.file_path)
+            # Release the stored file
+            release_file(db, chart)
             db.delete(chart)
         db.commit()
+        reaper.wake()
     
     # Create charts directory for this flight
     payload_dir = os.path.join(FLIGHTS_DIR, db_flight.payload_id)
@@ -272,14 +541,38 @@ def generate_charts(flight_id: str, db: Session = Depends(get_db)):
     os.makedirs(flight_charts_dir, exist_ok=True)
     
     generated_charts = []
-    
-    # Run all chart scripts
-    chart_scripts = [f for f in os.listdir(CHART_SCRIPTS_DIR) if f.endswith('.py')]
+    input_hash = input_fingerprint(csv_files)
+    
+    # Smooth, differentiate and detect events once for all scripts
+    try:
+        signals_key, signals_cached, signals_hash, signals_path = _render_signals(
+            db, csv_files, input_hash, flight_charts_dir
+        )
+    except Exception as e:
+        print(f"Exception processing signals for flight {flight_id}: {str(e)}")
+        signals_key, signals_cached, signals_hash, signals_path = None, True, None, None
+    
+    # Run all chart scripts (files starting with an underscore are helpers).
+    # Scripts run without any database writes, so the SQLite write lock is
+    # only held by the short transaction that records their results below.
+    script_files = sorted(f for f in os.listdir(CHART_SCRIPTS_DIR) if f.endswith('.py'))
+    chart_scripts = [f for f in script_files if not f.startswith('_')]
+    # Scripts may import any helper, so a helper change invalidates all cached outputs
+    helper_hashes = {
+        f: file_hash(os.path.join(CHART_SCRIPTS_DIR, f)) for f in script_files if f.startswith('_')
+    }
+    results = []
     
     for script_name in chart_scripts:
         script_path = os.path.join(CHART_SCRIPTS_DIR, script_name)
         
         try:
+            # Reuse the outputs of an earlier run on identical data
+            cache_key = chart_cache_key(script_path, input_hash, {"signals": signals_hash, "helpers": helper_hashes})
+            if peek_chart_cache(db, cache_key) is not None:
+                results.append((script_name, cache_key, None))
+                continue
+            
             # Run the chart script
             # Pass flight_id, flight_dir, and csv files as environment variables
             env = os.environ.copy()
@@ -287,6 +580,7 @@ def generate_charts(flight_id: str, db: Session = Depends(get_db)):
             env['FLIGHT_DIR'] = flight_dir
             env['FLIGHT_CHARTS_DIR'] = flight_charts_dir
             env['CSV_FILES'] = ','.join([cf.file_path for cf in csv_files])
+            env['FLIGHT_SIGNALS'] = signals_path or ''
             
             result = subprocess.run(
                 ['python', script_path],
@@ -299,23 +593,58 @@ def generate_charts(flight_id: str, db: Session = Depends(get_db)):
             if result.returncode == 0:
                 # Script should output chart filenames (one per line)
                 chart_files = [line.strip() for line in result.stdout.strip().split('\n') if line.strip()]
+                rendered = []
                 
                 for chart_file in chart_files:
                     chart_path = os.path.join(flight_charts_dir, chart_file)
                     if os.path.exists(chart_path):
-                        chart_name = os.path.splitext(script_name)[0] + "_" + chart_file
-                        db_chart = Chart(
-                            flight_id=flight_id,
-                            name=chart_name,
-                            file_path=chart_path
-                        )
-                        db.add(db_chart)
-                        generated_charts.append(db_chart)
+                        rendered.append((chart_file, chart_path, file_hash(chart_path)))
+                
+                results.append((script_name, cache_key, rendered))
             else:
                 print(f"Error running chart script {script_name}: {result.stderr}")
         except Exception as e:
             print(f"Exception running chart script {script_name}: {str(e)}")
     
+    # Record all results in one transaction
+    if signals_key is not None:
+        try:
+            if signals_cached:
+                lookup_chart_cache(db, signals_key)
+            else:
+                _store_signals(db, signals_key, signals_hash, signals_path)
+        except Exception as e:
+            print(f"Exception storing signals for flight {flight_id}: {str(e)}")
+    
+    for script_name, cache_key, rendered in results:
+        try:
+            if rendered is None:
+                outputs = lookup_chart_cache(db, cache_key)
+                if outputs is None:
+                    print(f"Cached charts for {script_name} were evicted during rendering")
+                    continue
+                for _, blob_hash in outputs:
+                    retain_blob(db, blob_hash)
+            else:
+                # Move the rendered charts into the blob store
+                outputs = [
+                    (chart_file, store_file(db, chart_path, chart_hash).hash)
+                    for chart_file, chart_path, chart_hash in rendered
+                ]
+                store_chart_cache(db, cache_key, outputs)
+            
+            for chart_file, blob_hash in outputs:
+                db_chart = Chart(
+                    flight_id=flight_id,
+                    name=os.path.splitext(script_name)[0] + "_" + chart_file,
+                    file_path=blob_path(blob_hash),
+                    blob_hash=blob_hash
+                )
+                db.add(db_chart)
+                generated_charts.append(db_chart)
+        except Exception as e:
+            print(f"Exception storing charts for {script_name}: {str(e)}")
+    
     db.commit()
     
     # Refresh all charts
@@ -339,8 +668,9 @@ def get_chart_file(chart_id: str, db: Session = Depends(get_db)):
     
     from fastapi.responses import FileResponse
     if os.path.exists(chart.file_path):
-        # Determine media type based on file extension
-        media_type = "text/html" if chart.file_path.endswith(".html") else None
+        # Determine media type based on the chart's file extension, since
+        # stored blobs are named by hash
+        media_type = mimetypes.guess_type(chart.name)[0]
         return FileResponse(chart.file_path, media_type=media_type)
     else:
         raise HTTPException(status_code=404, detail="Chart file not found")
@@ -352,12 +682,12 @@ def delete_chart(chart_id: str, db: Session = Depends(get_db)):
     if not db_chart:
         raise HTTPException(status_code=404, detail="Chart not found")
     
-    # Delete file from disk
-    if os.path.exists(db_chart.file_path):
-        os.remove(db_chart.file_path)
+    # Release the stored file
+    release_file(db, db_chart)
     
     db.delete(db_chart)
     db.commit()
+    reaper.wake()
     return {"message": "Chart deleted successfully"}
 
 
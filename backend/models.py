@@ -41,6 +41,7 @@ class CSVFile(Base):
     flight_id = Column(String, ForeignKey("flights.id"), nullable=False)
     filename = Column(String, nullable=False)
     file_path = Column(String, nullable=False)
+    blob_hash = Column(String, ForeignKey("blobs.hash"), nullable=True)
     uploaded_at = Column(DateTime, default=datetime.utcnow)
     
     flight = relationship("Flight", back_populates="csv_files")
@@ -53,7 +54,43 @@ class Chart(Base):
     flight_id = Column(String, ForeignKey("flights.id"), nullable=False)
     name = Column(String, nullable=False)
     file_path = Column(String, nullable=False)
+    blob_hash = Column(String, ForeignKey("blobs.hash"), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     flight = relationship("Flight", back_populates="charts")
 
+
+
+class Blob(Base):
+    __tablename__ = "blobs"
+    
+    hash = Column(String, primary_key=True)
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ChartCacheEntry(Base):
+    __tablename__ = "chart_cache"
+    
+    key = Column(String, primary_key=True)
+    outputs = Column(Text, nullable=False)
+    size = Column(Integer, nullable=False, default=0)
+    last_used_at = Column(DateTime, default=datetime.utcnow)
+
+
+class JobClaim(Base):
+    __tablename__ = "job_claims"
+    
+    key = Column(String, primary_key=True)
+    owner = Column(String, nullable=False)
+    claimed_at = Column(DateTime, nullable=False)
+    detail = Column(Text, nullable=True)
+
+
+class PendingDeletion(Base):
+    __tablename__ = "pending_deletions"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    path = Column(String, nullable=False)
+    enqueued_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,261 @@
+"""
+Signal processing stage for chart scripts.
+
+Runs once per flight before the chart scripts: the CSV data is combined,
+resampled onto a uniform time grid and smoothed, velocity and acceleration
+are derived from altitude (or from barometric pressure when no altitude was
+logged), and launch, burnout, apogee and deployment are detected. Everything
+is vectorized with NumPy/SciPy. The result is saved as an .npz file whose
+path chart scripts receive in FLIGHT_SIGNALS.
+"""
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.linalg import solve_discrete_are
+from scipy.signal import lfilter, savgol_filter, ss2tf
+
+# Processing configuration
+SIGNALS_SMOOTHING = os.getenv("SIGNALS_SMOOTHING", "savgol")
+SIGNALS_WINDOW_SECONDS = float(os.getenv("SIGNALS_WINDOW_SECONDS", "0.5"))
+SIGNALS_KALMAN_PROCESS_NOISE = float(os.getenv("SIGNALS_KALMAN_PROCESS_NOISE", "100000"))
+SIGNALS_KALMAN_MEASUREMENT_NOISE = float(os.getenv("SIGNALS_KALMAN_MEASUREMENT_NOISE", "1"))
+SIGNALS_LAUNCH_VELOCITY = float(os.getenv("SIGNALS_LAUNCH_VELOCITY", "5"))
+SIGNALS_DEPLOYMENT_ACCELERATION = float(os.getenv("SIGNALS_DEPLOYMENT_ACCELERATION", "5"))
+# Upper bound on the uniform grid, as a multiple of the number of readings
+SIGNALS_MAX_RESAMPLE_FACTOR = float(os.getenv("SIGNALS_MAX_RESAMPLE_FACTOR", "4"))
+# Gaps longer than this many median sample intervals split the data
+SIGNALS_MAX_GAP_SAMPLES = 100
+
+TIME_COLUMNS = ['time', 'timestamp', 't', 'elapsed_time', 'elapsed']
+ALTITUDE_COLUMNS = ['altitude', 'alt', 'height', 'h']
+PRESSURE_COLUMNS = ['pressure', 'press', 'baro', 'p']
+
+
+def processing_params():
+    """Settings that change the output, for use in cache keys"""
+    return {
+        "smoothing": SIGNALS_SMOOTHING,
+        "window_seconds": SIGNALS_WINDOW_SECONDS,
+        "kalman_process_noise": SIGNALS_KALMAN_PROCESS_NOISE,
+        "kalman_measurement_noise": SIGNALS_KALMAN_MEASUREMENT_NOISE,
+        "launch_velocity": SIGNALS_LAUNCH_VELOCITY,
+        "deployment_acceleration": SIGNALS_DEPLOYMENT_ACCELERATION,
+        "max_resample_factor": SIGNALS_MAX_RESAMPLE_FACTOR,
+    }
+
+
+def _find_column(df, names):
+    for col in df.columns:
+        if str(col).strip().lower() in names:
+            return col
+    return None
+
+
+def pressure_altitude(pressure):
+    """Barometric altitude relative to the first (ground) readings"""
+    ground = np.nanmedian(pressure[:max(1, min(len(pressure), 20))])
+    return 44330.0 * (1.0 - np.power(pressure / ground, 1.0 / 5.255))
+
+
+def savgol_smooth(altitude, dt, window_seconds=SIGNALS_WINDOW_SECONDS):
+    """Savitzky-Golay smoothed altitude, velocity and acceleration"""
+    window = max(5, int(round(window_seconds / dt)) | 1)
+    if window > len(altitude):
+        window = len(altitude) if len(altitude) % 2 else len(altitude) - 1
+    polyorder = min(3, window - 1)
+    return tuple(
+        savgol_filter(altitude, window, polyorder, deriv=deriv, delta=dt, mode="interp")
+        for deriv in (0, 1, 2)
+    )
+
+
+def kalman_smooth(altitude, dt,
+                  process_noise=SIGNALS_KALMAN_PROCESS_NOISE,
+                  measurement_noise=SIGNALS_KALMAN_MEASUREMENT_NOISE):
+    """
+    Steady-state Kalman filter with a constant-acceleration model.
+
+    With constant gains the filter is a linear time-invariant system, so each
+    state is computed with lfilter instead of a per-sample Python loop. Unlike
+    Savitzky-Golay the filter is causal, so derived signals lag slightly.
+    """
+    F = np.array([[1.0, dt, dt * dt / 2], [0.0, 1.0, dt], [0.0, 0.0, 1.0]])
+    H = np.array([[1.0, 0.0, 0.0]])
+    G = np.array([[dt ** 3 / 6], [dt * dt / 2], [dt]])
+    Q = process_noise * G @ G.T
+    R = np.array([[measurement_noise]])
+
+    P = solve_discrete_are(F.T, H.T, Q, R)
+    K = P @ H.T @ np.linalg.inv(H @ P @ H.T + R)
+    A = (np.eye(3) - K @ H) @ F
+
+    # Start from rest at the first reading to avoid a large initial transient.
+    # With the previous estimate as the LTI state, the current estimate is the
+    # output A x + K z, hence C = e_i A and D = e_i K
+    offset = altitude[0]
+    states = []
+    for i in range(3):
+        e_i = np.eye(3)[i:i + 1]
+        num, den = ss2tf(A, K, e_i @ A, e_i @ K)
+        states.append(lfilter(num[0], den, altitude - offset))
+    states[0] = states[0] + offset
+    return tuple(states)
+
+
+def _longest_run(time, values, max_gap):
+    """Slice out the longest stretch of readings without a gap above max_gap"""
+    gaps = np.flatnonzero(np.diff(time) > max_gap) + 1
+    bounds = np.concatenate(([0], gaps, [len(time)]))
+    longest = int(np.argmax(np.diff(bounds)))
+    start, end = bounds[longest], bounds[longest + 1]
+    return time[start:end], values[start:end]
+
+
+def _resample_size(time):
+    dt = float(np.median(np.diff(time)))
+    return dt, int(math.floor((time[-1] - time[0]) / dt)) + 1
+
+
+def _event(index, time, altitude):
+    if index is None:
+        return None
+    return {"index": int(index), "time": float(time[index]), "altitude": float(altitude[index])}
+
+
+def detect_events(time, altitude, velocity, acceleration, edge=0,
+                  launch_velocity=SIGNALS_LAUNCH_VELOCITY,
+                  deployment_acceleration=SIGNALS_DEPLOYMENT_ACCELERATION):
+    """
+    Find launch, burnout, apogee and deployment in smoothed signals.
+
+    edge is the number of trailing samples to ignore, typically half the
+    smoothing window.
+    """
+    apogee = int(np.argmax(altitude))
+
+    # Launch: the last moment at rest before the rocket first exceeds launch_velocity
+    launch = None
+    ascending = np.flatnonzero(velocity[:apogee + 1] > launch_velocity)
+    if len(ascending):
+        at_rest = np.flatnonzero(velocity[:ascending[0]] <= 0.1 * launch_velocity)
+        launch = int(at_rest[-1]) if len(at_rest) else 0
+
+    # Burnout: acceleration first turns negative between launch and apogee
+    burnout = None
+    if launch is not None:
+        coasting = np.flatnonzero(acceleration[launch:apogee + 1] < 0)
+        if len(coasting):
+            burnout = launch + int(coasting[0])
+
+    # Deployment: the first upward kick while descending, ignoring the last
+    # samples where smoothing edge effects dominate
+    deployment = None
+    kicks = np.flatnonzero(acceleration[apogee:len(altitude) - edge] > deployment_acceleration)
+    if len(kicks):
+        deployment = apogee + int(kicks[0])
+
+    return {
+        "launch": _event(launch, time, altitude),
+        "burnout": _event(burnout, time, altitude),
+        "apogee": _event(apogee, time, altitude),
+        "deployment": _event(deployment, time, altitude),
+    }
+
+
+def process_flight(csv_paths, output_path):
+    """
+    Run the processing stage over a flight's CSV files.
+
+    Writes the signals to output_path (.npz) and returns True, or returns
+    False when the data has no usable altitude or pressure column.
+    """
+    frames = []
+    for csv_path in csv_paths:
+        try:
+            frames.append(pd.read_csv(csv_path))
+        except Exception as e:
+            print(f"Error reading {csv_path}: {e}")
+    if not frames:
+        return False
+    df = pd.concat(frames, ignore_index=True)
+
+    altitude_col = _find_column(df, ALTITUDE_COLUMNS)
+    pressure_col = _find_column(df, PRESSURE_COLUMNS)
+    time_col = _find_column(df, TIME_COLUMNS)
+
+    # Pressure is only converted once the readings are in time order, since
+    # the first readings are the ground reference
+    if altitude_col is not None:
+        raw_altitude = pd.to_numeric(df[altitude_col], errors="coerce").to_numpy(dtype=np.float64)
+        source = "altitude"
+    elif pressure_col is not None:
+        raw_altitude = pd.to_numeric(df[pressure_col], errors="coerce").to_numpy(dtype=np.float64)
+        source = "pressure"
+    else:
+        return False
+
+    if time_col is not None:
+        raw_time = pd.to_numeric(df[time_col], errors="coerce").to_numpy(dtype=np.float64)
+    else:
+        raw_time = np.arange(len(raw_altitude), dtype=np.float64)
+
+    # Drop unusable samples and order by time
+    valid = np.isfinite(raw_time) & np.isfinite(raw_altitude)
+    if source == "pressure":
+        valid &= raw_altitude > 0
+    raw_time, raw_altitude = raw_time[valid], raw_altitude[valid]
+    order = np.argsort(raw_time, kind="stable")
+    raw_time, raw_altitude = raw_time[order], raw_altitude[order]
+    raw_time, unique = np.unique(raw_time, return_index=True)
+    raw_altitude = raw_altitude[unique]
+    if len(raw_time) < 5:
+        return False
+    if source == "pressure":
+        raw_altitude = pressure_altitude(raw_altitude)
+
+    # Filters and derivatives need a uniform sample rate
+    dt, samples = _resample_size(raw_time)
+    max_samples = SIGNALS_MAX_RESAMPLE_FACTOR * len(raw_time)
+    if samples > max_samples:
+        # An outlier timestamp or a long logging gap would blow up the grid,
+        # so only the longest stretch of continuous data is processed
+        raw_time, raw_altitude = _longest_run(raw_time, raw_altitude, SIGNALS_MAX_GAP_SAMPLES * dt)
+        if len(raw_time) < 5:
+            print(f"Skipping signal processing: no continuous stretch of data in {csv_paths}")
+            return False
+        dt, samples = _resample_size(raw_time)
+        max_samples = SIGNALS_MAX_RESAMPLE_FACTOR * len(raw_time)
+        if samples > max_samples:
+            print(f"Skipping signal processing: {samples} resampled points for {len(raw_time)} readings")
+            return False
+    time = raw_time[0] + dt * np.arange(samples)
+    altitude = np.interp(time, raw_time, raw_altitude)
+
+    if SIGNALS_SMOOTHING == "kalman":
+        smooth, velocity, acceleration = kalman_smooth(altitude, dt)
+    else:
+        smooth, velocity, acceleration = savgol_smooth(altitude, dt)
+
+    edge = int(round(SIGNALS_WINDOW_SECONDS / dt / 2))
+    events = detect_events(time, smooth, velocity, acceleration, edge=edge)
+
+    with open(output_path, "wb") as f:
+        np.savez(
+            f,
+            time=time,
+            altitude=altitude,
+            altitude_smooth=smooth,
+            velocity=velocity,
+            acceleration=acceleration,
+            meta=np.array(json.dumps({
+                "source": source,
+                "time_column": time_col,
+                "dt": dt,
+                "events": events,
+                "params": processing_params(),
+            })),
+        )
+    return True
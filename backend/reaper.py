@@ -0,0 +1,284 @@
+"""
+Background file reaper.
+
+Delete endpoints only commit the metadata change plus a PendingDeletion row;
+the files themselves are removed later by the reaper thread. Because the
+queue lives in the database, deletions that were committed but not yet
+processed survive a crash and are picked up on the next start.
+"""
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import SessionLocal
+from jobs import JOB_CLAIM_TIMEOUT, claim_job, job_heartbeat
+from models import Payload, Flight, CSVFile, Chart, Blob, JobClaim, PendingDeletion
+
+# Reaper configuration
+REAPER_INTERVAL = float(os.getenv("REAPER_INTERVAL", "30"))
+REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", "100"))
+REAPER_SWEEP_INTERVAL = float(os.getenv("REAPER_SWEEP_INTERVAL", "3600"))
+# Files younger than this are never treated as orphans, so an upload or chart
+# render that has written its file but not yet committed its row is left alone
+REAPER_ORPHAN_GRACE = float(os.getenv("REAPER_ORPHAN_GRACE", "3600"))
+
+
+def enqueue_deletion(db, path):
+    """Queue a file or directory for removal in the caller's transaction"""
+    db.add(PendingDeletion(path=path))
+
+
+def _is_blob_path(path, blobs_dir):
+    """Check whether path is a blob in the store (not a temp file)"""
+    if not blobs_dir:
+        return False
+    prefix_dir = os.path.dirname(path)
+    return (
+        os.path.normpath(os.path.dirname(prefix_dir)) == os.path.normpath(blobs_dir)
+        and os.path.basename(prefix_dir) != "tmp"
+    )
+
+
+def _is_referenced(db, path, blobs_dir=None):
+    """Check whether a live blob, CSVFile or Chart row still points at path"""
+    # A blob can be acquired again after it was queued, possibly only by a
+    # chart cache entry, so its refcount is what keeps the file alive
+    if _is_blob_path(path, blobs_dir):
+        blob = db.get(Blob, os.path.basename(path))
+        if blob is not None and blob.ref_count > 0:
+            return True
+    if db.query(CSVFile.id).filter(CSVFile.file_path == path).first():
+        return True
+    if db.query(Chart.id).filter(Chart.file_path == path).first():
+        return True
+    return False
+
+
+def _remove_path(path):
+    """Remove a file or directory tree; a missing path counts as removed"""
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _requeue(db, path, error):
+    """Put a path that could not be removed at the back of the queue"""
+    print(f"Warning: Could not remove {path}: {error}")
+    enqueue_deletion(db, path)
+    db.commit()
+
+
+def reap_pending(db, batch_size=REAPER_BATCH_SIZE, blobs_dir=None):
+    """
+    Remove one batch of queued paths, returning the number removed.
+
+    The SQLite write lock is only held for bookkeeping, never for removing
+    files: a blob is renamed to a tombstone while the lock is held and
+    unlinked after the commit, and other paths (legacy files and payload,
+    flight and stream folders, whose names are never reused) are removed
+    after their dequeue is committed. A path that cannot be removed moves to
+    the back of the queue so it does not hold up the items behind it.
+    """
+    pending = (
+        db.query(PendingDeletion.id, PendingDeletion.path)
+        .order_by(PendingDeletion.id)
+        .limit(batch_size)
+        .all()
+    )
+    reaped = 0
+    for item_id, path in pending:
+        # Dequeue first: the write takes the SQLite lock, so no upload can
+        # start referencing the path again until this item is committed
+        dequeued = db.query(PendingDeletion).filter(PendingDeletion.id == item_id).delete()
+        if not dequeued:
+            # Another worker's reaper already took this item
+            db.rollback()
+            continue
+        # A path can be reused after it was queued (e.g. the same content
+        # uploaded again), in which case the new file must survive
+        if _is_referenced(db, path, blobs_dir):
+            db.commit()
+            reaped += 1
+            continue
+
+        if _is_blob_path(path, blobs_dir):
+            # A blob could be acquired again as soon as the lock is released,
+            # so it has to leave its place in the store before the commit
+            tombstone_dir = os.path.join(blobs_dir, "tmp")
+            tombstone = os.path.join(tombstone_dir, f"{os.path.basename(path)}.{item_id}.reaped")
+            try:
+                os.makedirs(tombstone_dir, exist_ok=True)
+                os.replace(path, tombstone)
+            except FileNotFoundError:
+                tombstone = None
+            except OSError as e:
+                _requeue(db, path, e)
+                continue
+            db.commit()
+            path = tombstone
+        else:
+            db.commit()
+
+        if path is not None:
+            try:
+                _remove_path(path)
+            except OSError as e:
+                _requeue(db, path, e)
+                continue
+        reaped += 1
+    return reaped
+
+
+def _is_stale(path, now, grace):
+    try:
+        return now - os.path.getmtime(path) > grace
+    except OSError:
+        return False
+
+
+def _has_entries(path, ignore=()):
+    try:
+        return any(entry.name not in ignore for entry in os.scandir(path))
+    except OSError:
+        return False
+
+
+def sweep_orphans(db, flights_dir, blobs_dir=None, grace=REAPER_ORPHAN_GRACE, missing=None):
+    """
+    Reconcile the flights and blobs directories with the database.
+
+    Directories and files that no row refers to are queued for deletion.
+    CSVFile/Chart rows whose file has disappeared are removed once they were
+    also missing in the previous sweep, whose result is passed as missing.
+    Returns the rows found missing in this sweep.
+    """
+    now = time.time()
+    payload_ids = {row.id for row in db.query(Payload.id)}
+    flight_ids = {row.id for row in db.query(Flight.id)}
+    known_files = {row.file_path for row in db.query(CSVFile.file_path)}
+    known_files.update(row.file_path for row in db.query(Chart.file_path))
+    queued = {row.path for row in db.query(PendingDeletion.path)}
+    # Flights with a live telemetry ingest, whose stream folder has no row yet
+    # and may sit untouched for a long time while a receiver idles on the pad
+    streaming = {
+        row.key.split(":", 1)[1]
+        for row in db.query(JobClaim.key).filter(
+            JobClaim.key.like("telemetry:%"),
+            JobClaim.claimed_at >= datetime.utcnow() - timedelta(seconds=JOB_CLAIM_TIMEOUT),
+        )
+    }
+
+    def enqueue_orphan(path):
+        if path not in queued and _is_stale(path, now, grace):
+            enqueue_deletion(db, path)
+            queued.add(path)
+
+    if os.path.isdir(flights_dir):
+        for payload_entry in os.scandir(flights_dir):
+            if not payload_entry.is_dir() or payload_entry.name not in payload_ids:
+                enqueue_orphan(payload_entry.path)
+                continue
+            for flight_entry in os.scandir(payload_entry.path):
+                if not flight_entry.is_dir() or flight_entry.name not in flight_ids:
+                    enqueue_orphan(flight_entry.path)
+                    continue
+                for file_entry in os.scandir(flight_entry.path):
+                    if file_entry.name.startswith("telemetry-") and flight_entry.name in streaming:
+                        continue
+                    if file_entry.is_dir() and file_entry.name == "charts":
+                        for chart_entry in os.scandir(file_entry.path):
+                            if chart_entry.path not in known_files:
+                                enqueue_orphan(chart_entry.path)
+                    elif file_entry.path not in known_files:
+                        enqueue_orphan(file_entry.path)
+
+    if blobs_dir and os.path.isdir(blobs_dir):
+        blob_hashes = {row.hash for row in db.query(Blob.hash)}
+        for prefix_entry in os.scandir(blobs_dir):
+            if not prefix_entry.is_dir():
+                enqueue_orphan(prefix_entry.path)
+                continue
+            # Leftover temp files from interrupted uploads land here as well
+            for blob_entry in os.scandir(prefix_entry.path):
+                if blob_entry.name not in blob_hashes:
+                    enqueue_orphan(blob_entry.path)
+
+    # Rows whose file is gone. A missing or empty data directory more likely
+    # means an unmounted volume than lost files, so rows are left alone then
+    now_missing = set()
+    storage_present = _has_entries(flights_dir) and (not blobs_dir or _has_entries(blobs_dir, ignore={"tmp"}))
+    if storage_present:
+        from blobstore import release_file
+        for model in (CSVFile, Chart):
+            for row in db.query(model).all():
+                if os.path.exists(row.file_path):
+                    continue
+                key = (model.__tablename__, row.id)
+                now_missing.add(key)
+                if missing and key in missing:
+                    release_file(db, row)
+                    db.delete(row)
+                else:
+                    print(f"Warning: File of {model.__name__} {row.id} is missing: {row.file_path}")
+
+    db.commit()
+    return now_missing
+
+
+class FileReaper:
+    """Daemon thread that drains the deletion queue and sweeps for orphans"""
+
+    def __init__(self, flights_dir, blobs_dir=None):
+        self.flights_dir = flights_dir
+        self.blobs_dir = blobs_dir
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_sweep = 0.0
+        self._missing = set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="file-reaper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def wake(self):
+        """Ask the reaper to run now instead of waiting for the next interval"""
+        self._wake.set()
+
+    def run_once(self):
+        db = SessionLocal()
+        try:
+            if time.time() - self._last_sweep >= REAPER_SWEEP_INTERVAL:
+                # With several workers only one of them sweeps at a time
+                if claim_job("reaper:sweep"):
+                    with job_heartbeat("reaper:sweep"):
+                        self._missing = sweep_orphans(
+                            db, self.flights_dir, self.blobs_dir, missing=self._missing
+                        )
+                self._last_sweep = time.time()
+            # Drain the queue one batch at a time
+            while not self._stop.is_set() and reap_pending(db, blobs_dir=self.blobs_dir) == REAPER_BATCH_SIZE:
+                pass
+        finally:
+            db.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error in file reaper: {e}")
+            self._wake.wait(REAPER_INTERVAL)
+            self._wake.clear()
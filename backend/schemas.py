@@ -78,6 +78,7 @@ class CSVFileBase(BaseModel):
 class CSVFile(CSVFileBase):
     id: str
     flight_id: str
+    blob_hash: Optional[str] = None
     uploaded_at: datetime
     
     class Config:
@@ -92,6 +93,7 @@ class ChartBase(BaseModel):
 class Chart(ChartBase):
     id: str
     flight_id: str
+    blob_hash: Optional[str] = None
     created_at: datetime
     
     class Config:
@@ -0,0 +1,283 @@
+"""
+Live telemetry ingest.
+
+A ground-station receiver streams CSV lines for a flight over a WebSocket.
+Rows are spooled to disk as they arrive: the raw lines to a CSV file and the
+parsed values to one append-only float64 file per column, so memory use is
+bounded by a single chunk regardless of stream length. Connected viewers get
+a decimated copy of every flushed chunk. When the stream closes, the spooled
+CSV is stored the same way as an uploaded one.
+
+With several API workers, viewers connected to a worker other than the one
+ingesting the stream are served by a TelemetryTail, which follows the
+append-only column files on the shared disk.
+"""
+import asyncio
+import csv
+import io
+import math
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+# Telemetry configuration
+TELEMETRY_CHUNK_ROWS = int(os.getenv("TELEMETRY_CHUNK_ROWS", "4096"))
+TELEMETRY_FLUSH_INTERVAL = float(os.getenv("TELEMETRY_FLUSH_INTERVAL", "0.25"))
+TELEMETRY_LIVE_POINTS = int(os.getenv("TELEMETRY_LIVE_POINTS", "200"))
+TELEMETRY_SNAPSHOT_POINTS = int(os.getenv("TELEMETRY_SNAPSHOT_POINTS", "2000"))
+TELEMETRY_VIEWER_QUEUE = int(os.getenv("TELEMETRY_VIEWER_QUEUE", "64"))
+# How often a worker with viewers looks for a stream ingested by another worker
+TELEMETRY_OWNER_CHECK_INTERVAL = float(os.getenv("TELEMETRY_OWNER_CHECK_INTERVAL", "1"))
+
+
+def _decimate(values, max_points):
+    """Take evenly strided rows so at most max_points remain"""
+    stride = max(1, math.ceil(len(values) / max_points))
+    return values[::stride]
+
+
+def _json_rows(values):
+    """Convert a float array to nested lists with NaN as None"""
+    return np.where(np.isnan(values), None, values).tolist()
+
+
+def _column_path(stream_dir, index):
+    return os.path.join(stream_dir, f"col_{index}.f64")
+
+
+def _read_rows(stream_dir, columns, start, stop, stride=1):
+    """Read rows start to stop (every stride-th) from a stream's column files"""
+    if not columns or stop <= start:
+        return np.empty((0, len(columns or [])))
+    return np.column_stack([
+        np.array(np.memmap(_column_path(stream_dir, i), dtype=np.float64, mode="r", shape=(stop,))[start:stop:stride])
+        for i in range(len(columns))
+    ])
+
+
+def _snapshot_message(columns, values, rows):
+    return {
+        "event": "snapshot",
+        "columns": columns,
+        "rows": _json_rows(values),
+        "total_rows": rows,
+    }
+
+
+def _snapshot_stride(rows):
+    return max(1, math.ceil(rows / TELEMETRY_SNAPSHOT_POINTS))
+
+
+def _rows_message(columns, values, total_rows):
+    return {
+        "event": "rows",
+        "columns": columns,
+        "rows": _json_rows(_decimate(values, TELEMETRY_LIVE_POINTS)),
+        "total_rows": total_rows,
+    }
+
+
+class TelemetryStream:
+    """Spool for one live ingest connection"""
+
+    def __init__(self, flight_id, stream_dir):
+        self.flight_id = flight_id
+        self.stream_dir = stream_dir
+        self.spool_path = os.path.join(stream_dir, "telemetry.csv")
+        self.columns = None
+        self.rows = 0
+        self.dropped = 0
+        # Set once the stream folder disappeared, e.g. its flight was deleted
+        self.lost = False
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._column_files = []
+
+        os.makedirs(stream_dir, exist_ok=True)
+        self._spool = open(self.spool_path, "w")
+
+    def append(self, text):
+        """Queue the CSV lines of one message, returning True when a flush is due"""
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if self.columns is None:
+                # First line of the stream is the header
+                self.columns = [name.strip().strip('"') for name in line.split(",")]
+                self._spool.write(",".join(self.columns) + "\n")
+                # Other workers read the column names from the spool
+                self._spool.flush()
+                self._column_files = [
+                    open(_column_path(self.stream_dir, i), "ab") for i in range(len(self.columns))
+                ]
+                continue
+            # Drop malformed rows so the final CSV stays readable. Quoting is
+            # not supported: an unbalanced quote would swallow the rows after it
+            if '"' in line or line.count(",") != len(self.columns) - 1:
+                self.dropped += 1
+                continue
+            self._pending.append(line)
+
+        return (
+            len(self._pending) >= TELEMETRY_CHUNK_ROWS
+            or time.monotonic() - self._last_flush >= TELEMETRY_FLUSH_INTERVAL
+        )
+
+    def flush(self):
+        """Write pending rows to disk, returning a live update message or None"""
+        with self._lock:
+            lines = self._pending
+            self._pending = []
+            self._last_flush = time.monotonic()
+            if not lines:
+                return None
+
+            chunk = "\n".join(lines) + "\n"
+
+            # Parse the whole chunk at once before anything is written, so a
+            # chunk that cannot be parsed never reaches the spool; non-numeric
+            # values become NaN
+            try:
+                frame = pd.read_csv(io.StringIO(chunk), header=None, dtype=str, quoting=csv.QUOTE_NONE)
+            except (ValueError, pd.errors.ParserError) as e:
+                print(f"Warning: Dropping unparseable telemetry chunk for flight {self.flight_id}: {e}")
+                self.dropped += len(lines)
+                return None
+            values = frame.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
+
+            # Keep the directory fresh so the orphan sweep leaves it alone
+            try:
+                os.utime(self.stream_dir)
+            except FileNotFoundError:
+                if not self.lost:
+                    print(f"Warning: Telemetry folder for flight {self.flight_id} was removed")
+                self.lost = True
+                self.dropped += len(lines)
+                return None
+
+            self._spool.write(chunk)
+            self._spool.flush()
+            for index, column_file in enumerate(self._column_files):
+                np.ascontiguousarray(values[:, index]).tofile(column_file)
+                column_file.flush()
+            self.rows += len(values)
+
+        return _rows_message(self.columns, values, self.rows)
+
+    def snapshot(self):
+        """Decimated view of everything received so far, for late viewers"""
+        with self._lock:
+            rows = 0 if self.lost else self.rows
+            values = _read_rows(self.stream_dir, self.columns, 0, rows, _snapshot_stride(rows))
+        return _snapshot_message(self.columns, values, rows)
+
+    def close(self):
+        """Close spool files; the caller should flush first"""
+        self._spool.close()
+        for column_file in self._column_files:
+            column_file.close()
+
+
+class TelemetryTail:
+    """
+    Follows a stream that another worker is ingesting.
+
+    The ingesting worker appends every flushed chunk to each column file, so
+    rows that all column files already hold are complete and can be read from
+    here. Files that disappear (the stream ended and was cleaned up) read as
+    no new rows.
+    """
+
+    def __init__(self, flight_id, stream_dir):
+        self.flight_id = flight_id
+        self.stream_dir = stream_dir
+        self.columns = None
+        self.rows = 0
+
+    def _available_rows(self):
+        if self.columns is None:
+            try:
+                with open(os.path.join(self.stream_dir, "telemetry.csv")) as spool:
+                    header = spool.readline()
+            except FileNotFoundError:
+                return 0
+            # The header is only complete once its newline was flushed
+            if not header.endswith("\n"):
+                return 0
+            self.columns = header.rstrip("\n").split(",")
+        try:
+            sizes = [os.path.getsize(_column_path(self.stream_dir, i)) for i in range(len(self.columns))]
+        except FileNotFoundError:
+            return 0
+        return min(sizes) // np.dtype(np.float64).itemsize
+
+    def poll(self):
+        """Return rows flushed since the last poll as a live update message, or None"""
+        rows = self._available_rows()
+        if rows <= self.rows:
+            return None
+        try:
+            values = _read_rows(self.stream_dir, self.columns, self.rows, rows)
+        except (FileNotFoundError, ValueError):
+            return None
+        self.rows = rows
+        return _rows_message(self.columns, values, rows)
+
+    def snapshot(self):
+        """Decimated view of everything flushed so far, for late viewers"""
+        rows = self._available_rows()
+        try:
+            values = _read_rows(self.stream_dir, self.columns, 0, rows, _snapshot_stride(rows))
+        except (FileNotFoundError, ValueError):
+            rows = 0
+            values = _read_rows(self.stream_dir, self.columns, 0, 0)
+        return _snapshot_message(self.columns, values, rows)
+
+
+class TelemetryHub:
+    """Tracks active ingest streams and fans updates out to viewers"""
+
+    def __init__(self):
+        self.streams = {}
+        # Streams of other workers followed for this worker's viewers, and
+        # the tasks following them
+        self.tails = {}
+        self.followers = {}
+        self.viewers = {}
+
+    def open_stream(self, flight_id, stream_dir):
+        """Start a stream for a flight, or return None if one is already active"""
+        if flight_id in self.streams:
+            return None
+        stream = TelemetryStream(flight_id, stream_dir)
+        self.streams[flight_id] = stream
+        return stream
+
+    def close_stream(self, flight_id):
+        stream = self.streams.pop(flight_id, None)
+        if stream is not None:
+            stream.close()
+
+    def subscribe(self, flight_id):
+        queue = asyncio.Queue(maxsize=TELEMETRY_VIEWER_QUEUE)
+        self.viewers.setdefault(flight_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, flight_id, queue):
+        queues = self.viewers.get(flight_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.viewers[flight_id]
+
+    def publish(self, flight_id, message):
+        for queue in self.viewers.get(flight_id, ()):
+            # Slow viewers lose their oldest update instead of stalling ingest
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message)
@@ -0,0 +1,34 @@
+"""
+Helper for chart scripts to read the flight's processed signals.
+
+The API runs a signal processing stage once per flight before the chart
+scripts and passes the result in FLIGHT_SIGNALS. Files starting with an
+underscore are not run as chart scripts.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def load_signals():
+    """
+    Load the processed signals for the current flight.
+
+    Returns (signals, meta) where signals is a DataFrame with time, altitude,
+    altitude_smooth, velocity and acceleration columns and meta holds the
+    detected events (launch, burnout, apogee, deployment), or (None, None)
+    if the flight data had no altitude or pressure to process.
+    """
+    signals_path = os.getenv('FLIGHT_SIGNALS', '')
+    if not signals_path or not os.path.exists(signals_path):
+        return None, None
+
+    with np.load(signals_path) as data:
+        meta = json.loads(data['meta'].item())
+        signals = pd.DataFrame({
+            name: data[name]
+            for name in ('time', 'altitude', 'altitude_smooth', 'velocity', 'acceleration')
+        })
+    return signals, meta
@@ -7,6 +7,7 @@ import os
 import sys
 import pandas as pd
 import plotly.graph_objects as go
+from _signals import load_signals
 
 def main():
     # Get environment variables
@@ -45,10 +46,6 @@ def main():
             altitude_col = col
             break
     
-    if altitude_col is None:
-        print("No altitude column found in CSV data", file=sys.stderr)
-        sys.exit(1)
-    
     # Try to find time column
     time_col = None
     for col in combined_df.columns:
@@ -56,6 +53,16 @@ def main():
             time_col = col
             break
     
+    signals, meta = load_signals()
+    if altitude_col is None:
+        # Fall back to altitude derived from barometric pressure
+        if signals is None:
+            print("No altitude column or processed signals found in CSV data", file=sys.stderr)
+            sys.exit(1)
+        combined_df = signals
+        altitude_col = 'altitude'
+        time_col = 'time' if meta['time_column'] else None
+    
     # Create the chart
     fig = go.Figure()
     
@@ -69,6 +76,16 @@ def main():
             marker=dict(size=4)
         ))
         fig.update_xaxes(title_text=time_col)
+        
+        # Mark detected flight events
+        if meta is not None and meta['time_column']:
+            for event_name, event in meta['events'].items():
+                if event is not None:
+                    fig.add_vline(
+                        x=event['time'],
+                        line=dict(color='gray', dash='dash'),
+                        annotation_text=event_name.capitalize()
+                    )
     else:
         fig.add_trace(go.Scatter(
             y=combined_df[altitude_col],
@@ -6,6 +6,7 @@ import os
 import sys
 import pandas as pd
 import plotly.graph_objects as go
+from _signals import load_signals
 
 def main():
     # Get environment variables
@@ -44,10 +45,6 @@ def main():
             velocity_col = col
             break
     
-    if velocity_col is None:
-        print("No velocity column found in CSV data", file=sys.stderr)
-        sys.exit(1)
-    
     # Try to find time column
     time_col = None
     for col in combined_df.columns:
@@ -55,6 +52,16 @@ def main():
             time_col = col
             break
     
+    if velocity_col is None:
+        # Fall back to velocity derived from altitude or pressure
+        signals, meta = load_signals()
+        if signals is None:
+            print("No velocity column or processed signals found in CSV data", file=sys.stderr)
+            sys.exit(1)
+        combined_df = signals
+        velocity_col = 'velocity'
+        time_col = 'time' if meta['time_column'] else None
+    
     # Create the chart
     fig = go.Figure()
     
@@ -15,9 +15,12 @@ trap cleanup SIGTERM SIGINT
 # Create database directory if it doesn't exist
 mkdir -p /app/db
 
-# Start FastAPI in the background
+# Run database migrations once before any worker starts
 cd /app/backend
-python -m uvicorn main:app --host 0.0.0.0 --port 8000 &
+python -c "from database import init_db; init_db()"
+
+# Start FastAPI in the background (WORKERS > 1 runs several API processes)
+SKIP_INIT_DB=1 python -m uvicorn main:app --host 0.0.0.0 --port 8000 --workers "${WORKERS:-1}" &
 UVICORN_PID=$!
 
 # Start nginx in foreground (this will block until nginx stops)